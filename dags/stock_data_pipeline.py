@@ -1,15 +1,26 @@
 from airflow import DAG
+from airflow.decorators import task
 from airflow.operators.python import PythonOperator
 from airflow.operators.bash import BashOperator
 from airflow.utils.dates import days_ago
 from datetime import datetime, timedelta
 import sys
 import os
+import time
 
-# Add scripts directory to Python path
+# Add scripts directory to Python path. StockDataFetcher is imported inside
+# the task callables so that parsing this DAG does not import requests,
+# psycopg2 and friends.
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
 
-from fetch_stock_data import StockDataFetcher
+# Get stock symbols from environment
+symbols_str = os.getenv('STOCK_SYMBOLS', 'AAPL,GOOGL,MSFT')
+symbols = [s.strip() for s in symbols_str.split(',')]
+
+# Single-slot Airflow pool throttling Alpha Vantage calls across all DAG
+# runs. Each fetch task holds the slot for one rate limit interval
+# (60 / ALPHA_VANTAGE_CALLS_PER_MINUTE seconds), whether it succeeds or not.
+ALPHA_VANTAGE_POOL = 'alpha_vantage_pool'
 
 # Default arguments for the DAG
 default_args = {
@@ -36,67 +47,80 @@ dag = DAG(
 def check_database_connection():
     """Task to verify database connection."""
     import logging
+    from fetch_stock_data import StockDataFetcher
     logger = logging.getLogger(__name__)
     
+    fetcher = None
     try:
         fetcher = StockDataFetcher()
         conn = fetcher.get_db_connection()
-        conn.close()
+        fetcher.release_db_connection(conn)
         logger.info("Database connection successful")
     except Exception as e:
-        logger.error(f"Database connection failed: {e}")
+        logger.error("Database connection failed: %s", e)
         raise
+    finally:
+        if fetcher:
+            fetcher.close()
 
 
-def fetch_and_store_stock_data():
-    """Task to fetch and store stock data."""
+@task(task_id='fetch_stock_data', pool=ALPHA_VANTAGE_POOL, pool_slots=1, dag=dag)
+def fetch_and_store_stock_data(symbol: str) -> dict:
+    """Task to fetch and store stock data for a single symbol."""
     import logging
+    from airflow.exceptions import AirflowException
+    from airflow.operators.python import get_current_context
+    from fetch_stock_data import StockDataFetcher
     logger = logging.getLogger(__name__)
     
-    # Get stock symbols from environment
-    symbols_str = os.getenv('STOCK_SYMBOLS', 'AAPL,GOOGL,MSFT')
-    symbols = [s.strip() for s in symbols_str.split(',')]
-    
-    logger.info(f"Processing symbols: {symbols}")
+    logger.info("Processing symbol: %s", symbol)
     
+    started = time.monotonic()
+    fetcher = None
     try:
         fetcher = StockDataFetcher()
-        results = fetcher.process_multiple_symbols(symbols)
-        
-        # Check results
-        success_count = sum(1 for v in results.values() if v)
-        total_count = len(symbols)
+        success = fetcher.process_symbol(symbol)
         
-        logger.info(f"Processed {success_count}/{total_count} symbols successfully")
+        status = "✓" if success else "✗"
+        logger.info("%s %s", status, symbol)
         
-        # Log individual results
-        for symbol, success in results.items():
-            status = "✓" if success else "✗"
-            logger.info(f"{status} {symbol}")
-        
-        # Fail the task if no symbols were processed successfully
-        if success_count == 0:
-            raise Exception("All symbols failed to process")
+        # Let Airflow retry the symbol; the last attempt reports the failure
+        ti = get_current_context()['ti']
+        if not success and ti.try_number <= ti.max_tries:
+            raise AirflowException(f"Failed to process {symbol}")
         
-        return results
+        return {'symbol': symbol, 'success': success}
         
     except Exception as e:
-        logger.error(f"Error in fetch_and_store_stock_data: {e}")
+        logger.error("Error in fetch_and_store_stock_data for %s: %s", symbol, e)
         raise
+    finally:
+        if fetcher:
+            fetcher.close()
+            
+            # Keep the pool slot until the next API call is allowed, also on
+            # failure since the API call may already have used quota
+            interval = fetcher.rate_limiter.period / fetcher.rate_limiter.calls
+            remaining = interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
 
 
 def generate_summary(**context):
     """Task to generate pipeline execution summary."""
     import logging
+    from airflow.exceptions import AirflowFailException
     logger = logging.getLogger(__name__)
     
-    # Get results from previous task
+    # Get results from the mapped fetch tasks
     ti = context['ti']
     results = ti.xcom_pull(task_ids='fetch_stock_data')
     
     if results:
-        success_count = sum(1 for v in results.values() if v)
+        results = list(results)
+        success_count = sum(1 for result in results if result['success'])
         total_count = len(results)
+        failed = [result['symbol'] for result in results if not result['success']]
         success_rate = (success_count / total_count) * 100 if total_count > 0 else 0
         
         summary = f"""
@@ -105,15 +129,23 @@ def generate_summary(**context):
         Total Symbols: {total_count}
         Successful: {success_count}
         Failed: {total_count - success_count}
+        Failed Symbols: {', '.join(failed) or 'None'}
         Success Rate: {success_rate:.2f}%
         ======================================
         """
         
         logger.info(summary)
-        return summary
+        
+        # Fail the run if no symbols were processed successfully. Retrying
+        # would only re-read the same results, so fail without retries.
+        if success_count == 0:
+            raise AirflowFailException("All symbols failed to process")
+        
+        # Only push counts and failed symbols to XCom, not the report text
+        return {'success': success_count, 'total': total_count, 'failed': failed}
     else:
         logger.warning("No results available from previous task")
-        return "No summary available"
+        return None
 
 
 # Task 1: Check database connection
@@ -123,12 +155,8 @@ check_db = PythonOperator(
     dag=dag,
 )
 
-# Task 2: Fetch and store stock data
-fetch_data = PythonOperator(
-    task_id='fetch_stock_data',
-    python_callable=fetch_and_store_stock_data,
-    dag=dag,
-)
+# Task 2: Fetch and store stock data, one mapped task instance per symbol
+fetch_data = fetch_and_store_stock_data.expand(symbol=symbols)
 
 # Task 3: Generate summary
 summary = PythonOperator(
@@ -1,56 +1,192 @@
+import functools
+import io
+import operator
 import os
+import ciso8601
+import orjson
 import requests
 import psycopg2
-from psycopg2.extras import execute_values
-from datetime import datetime
+import psycopg2.pool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import time
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Number of symbols processed concurrently
+MAX_WORKERS = 5
+
+# One line of COPY text input for a parsed row
+COPY_ROW_FORMAT = '%s\t%s\t%s\t%s\t%s\t%s\t%s\n'
+
+
+@functools.lru_cache(maxsize=1)
+def _load_config() -> Tuple[Optional[str], Dict[str, str], int]:
+    """
+    Read the pipeline configuration from environment variables once.
+    
+    Returns:
+        Tuple[Optional[str], Dict[str, str], int]: API key, database
+        connection parameters and allowed API calls per minute
+    """
+    api_key = os.getenv('ALPHA_VANTAGE_API_KEY')
+    db_config = {
+        'host': os.getenv('POSTGRES_HOST', 'postgres'),
+        'port': os.getenv('POSTGRES_PORT', '5432'),
+        'database': os.getenv('POSTGRES_DB', 'stock_data'),
+        'user': os.getenv('POSTGRES_USER', 'airflow'),
+        'password': os.getenv('POSTGRES_PASSWORD', 'airflow')
+    }
+    # Alpha Vantage free tier allows 5 API calls per minute
+    calls_per_minute = int(os.getenv('ALPHA_VANTAGE_CALLS_PER_MINUTE', '5'))
+    if calls_per_minute <= 0:
+        raise ValueError("ALPHA_VANTAGE_CALLS_PER_MINUTE must be a positive integer")
+    return api_key, db_config, calls_per_minute
+
+
+class RateLimiter:
+    """
+    A thread-safe rate limiter spacing calls evenly across a period.
+    """
+    
+    def __init__(self, calls: int, period: float = 60.0):
+        """
+        Initialize the limiter so that the first call is allowed immediately.
+        
+        Args:
+            calls (int): Number of calls allowed per period
+            period (float): Length of the period in seconds
+        """
+        self.calls = calls
+        self.period = period
+        self._interval = period / calls
+        self._next_allowed = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """
+        Block until a call is allowed.
+        
+        Each caller reserves the next free slot and only sleeps for whatever
+        is left of the interval since the previous slot, so time spent on the
+        previous request counts towards the wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            allowed_at = max(now, self._next_allowed)
+            self._next_allowed = allowed_at + self._interval
+        
+        if allowed_at > now:
+            time.sleep(allowed_at - now)
+
 
 class StockDataFetcher:
     """
     A class to fetch stock data from Alpha Vantage API and store it in PostgreSQL.
     """
     
+    __slots__ = (
+        'api_key',
+        'db_config',
+        'session',
+        'rate_limiter',
+        '_pool',
+        '_pool_lock'
+    )
+    
+    # Extracts OHLCV values from a single time series entry
+    _price_fields = operator.itemgetter(
+        '1. open', '2. high', '3. low', '4. close', '5. volume'
+    )
+    
+    base_url = "https://www.alphavantage.co/query"
+    
     def __init__(self):
         """Initialize the StockDataFetcher with environment variables."""
-        self.api_key = os.getenv('ALPHA_VANTAGE_API_KEY')
-        self.db_config = {
-            'host': os.getenv('POSTGRES_HOST', 'postgres'),
-            'port': os.getenv('POSTGRES_PORT', '5432'),
-            'database': os.getenv('POSTGRES_DB', 'stock_data'),
-            'user': os.getenv('POSTGRES_USER', 'airflow'),
-            'password': os.getenv('POSTGRES_PASSWORD', 'airflow')
-        }
-        self.base_url = "https://www.alphavantage.co/query"
+        self.api_key, db_config, calls_per_minute = _load_config()
+        
+        # Copy the cached mapping so instances cannot change each other's config
+        self.db_config = dict(db_config)
         
         # Validate configuration
         if not self.api_key:
             raise ValueError("ALPHA_VANTAGE_API_KEY environment variable not set")
+        
+        # Reuse connections to the API across requests
+        self.session = requests.Session()
+        retries = Retry(
+            total=3,
+            connect=3,
+            read=2,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['GET']
+        )
+        self.session.mount(
+            'https://',
+            HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries)
+        )
+        
+        self.rate_limiter = RateLimiter(calls_per_minute)
+        
+        # Database connections are pooled and opened on first use
+        self._pool = None
+        self._pool_lock = threading.Lock()
+    
+    def _get_pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        """
+        Return the database connection pool, creating it on first use.
+        
+        Returns:
+            psycopg2.pool.ThreadedConnectionPool: Shared connection pool
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    minconn=1,
+                    maxconn=10,
+                    **self.db_config
+                )
+            return self._pool
     
     def get_db_connection(self):
         """
-        Establish a connection to PostgreSQL database.
+        Get a connection to PostgreSQL database from the pool.
+        
+        The connection must be handed back with release_db_connection().
         
         Returns:
             psycopg2.connection: Database connection object
         """
         try:
-            conn = psycopg2.connect(**self.db_config)
-            logger.info("Successfully connected to PostgreSQL database")
+            conn = self._get_pool().getconn()
+            logger.debug("Successfully connected to PostgreSQL database")
             return conn
         except psycopg2.Error as e:
-            logger.error(f"Error connecting to PostgreSQL: {e}")
+            logger.error("Error connecting to PostgreSQL: %s", e)
             raise
     
+    def release_db_connection(self, conn):
+        """
+        Return a connection obtained from get_db_connection() to the pool.
+        
+        Args:
+            conn (psycopg2.connection): Database connection object
+        """
+        self._pool.putconn(conn)
+    
+    def close(self):
+        """Close all pooled database connections and the HTTP session."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+        self.session.close()
+    
     def fetch_stock_data(self, symbol: str) -> Optional[Dict]:
         """
         Fetch stock data for a given symbol from Alpha Vantage API.
@@ -70,36 +206,37 @@ class StockDataFetcher:
         }
         
         try:
-            logger.info(f"Fetching data for {symbol}")
-            response = requests.get(self.base_url, params=params, timeout=30)
+            self.rate_limiter.acquire()
+            logger.debug("Fetching data for %s", symbol)
+            response = self.session.get(self.base_url, params=params, timeout=(5, 25))
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
             # Check for API errors
             if "Error Message" in data:
-                logger.error(f"API Error for {symbol}: {data['Error Message']}")
+                logger.error("API Error for %s: %s", symbol, data['Error Message'])
                 return None
             
             if "Note" in data:
-                logger.warning(f"API Rate Limit for {symbol}: {data['Note']}")
+                logger.warning("API Rate Limit for %s: %s", symbol, data['Note'])
                 return None
             
             if "Time Series (60min)" not in data:
-                logger.warning(f"No time series data found for {symbol}")
+                logger.warning("No time series data found for %s", symbol)
                 return None
             
-            logger.info(f"Successfully fetched data for {symbol}")
+            logger.debug("Successfully fetched data for %s", symbol)
             return {
                 'symbol': symbol,
                 'data': data['Time Series (60min)']
             }
             
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching data for {symbol}: {e}")
+            logger.error("Error fetching data for %s: %s", symbol, e)
             return None
         except ValueError as e:
-            logger.error(f"Error parsing JSON response for {symbol}: {e}")
+            logger.error("Error parsing JSON response for %s: %s", symbol, e)
             return None
     
     def parse_stock_data(self, stock_data: Dict) -> List[tuple]:
@@ -112,39 +249,50 @@ class StockDataFetcher:
         Returns:
             List[tuple]: List of tuples containing parsed stock data
         """
-        parsed_data = []
         symbol = stock_data['symbol']
         time_series = stock_data['data']
         
         try:
-            for timestamp, values in time_series.items():
-                # Parse timestamp
-                dt = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-                
-                # Extract values with error handling
-                open_price = float(values.get('1. open', 0))
-                high_price = float(values.get('2. high', 0))
-                low_price = float(values.get('3. low', 0))
-                close_price = float(values.get('4. close', 0))
-                volume = int(values.get('5. volume', 0))
-                
-                parsed_data.append((
+            parsed_data = [
+                (
                     symbol,
-                    dt,
-                    open_price,
-                    high_price,
-                    low_price,
-                    close_price,
-                    volume
-                ))
+                    ciso8601.parse_datetime(timestamp),
+                    float(open_price),
+                    float(high_price),
+                    float(low_price),
+                    float(close_price),
+                    int(volume)
+                )
+                for timestamp, (open_price, high_price, low_price, close_price, volume)
+                in zip(time_series, map(self._price_fields, time_series.values()))
+            ]
             
-            logger.info(f"Parsed {len(parsed_data)} records for {symbol}")
+            logger.debug("Parsed %d records for %s", len(parsed_data), symbol)
             return parsed_data
             
         except (ValueError, KeyError) as e:
-            logger.error(f"Error parsing data for {symbol}: {e}")
+            logger.error("Error parsing data for %s: %s", symbol, e)
             return []
     
+    def fetch_and_parse(self, symbol: str) -> List[tuple]:
+        """
+        Fetch stock data for a symbol and parse it into rows.
+        
+        Convenience wrapper around fetch_stock_data() and parse_stock_data(),
+        which log their own failures.
+        
+        Args:
+            symbol (str): Stock symbol (e.g., 'AAPL')
+        
+        Returns:
+            List[tuple]: Parsed rows, or an empty list if fetching or parsing fails
+        """
+        stock_data = self.fetch_stock_data(symbol)
+        if not stock_data:
+            return []
+        
+        return self.parse_stock_data(stock_data)
+    
     def store_stock_data(self, parsed_data: List[tuple]) -> int:
         """
         Store parsed stock data in PostgreSQL database.
@@ -166,11 +314,49 @@ class StockDataFetcher:
             conn = self.get_db_connection()
             cursor = conn.cursor()
             
+            # Stage rows with COPY, then merge them in a single statement.
+            # The staging table is dropped automatically on commit.
+            cursor.execute("""
+                CREATE TEMP TABLE stock_prices_stage
+                ON COMMIT DROP AS
+                SELECT symbol, timestamp, open, high, low, close, volume
+                FROM stock_prices
+                WITH NO DATA
+            """)
+            
+            # Skip rows older than the latest stored bar of each symbol. The
+            # latest bar itself is rewritten in case it was still forming.
+            cursor.execute(
+                """
+                SELECT symbol, MAX(timestamp)
+                FROM stock_prices
+                WHERE symbol = ANY(%s)
+                GROUP BY symbol
+                """,
+                (list({row[0] for row in parsed_data}),)
+            )
+            latest = dict(cursor.fetchall())
+            parsed_data = [
+                row for row in parsed_data
+                if row[0] not in latest or row[1] >= latest[row[0]]
+            ]
+            
+            buffer = io.StringIO(''.join(
+                COPY_ROW_FORMAT % row for row in parsed_data
+            ))
+            
+            cursor.copy_from(
+                buffer,
+                'stock_prices_stage',
+                columns=('symbol', 'timestamp', 'open', 'high', 'low', 'close', 'volume')
+            )
+            
             # Insert or update data using ON CONFLICT
-            insert_query = """
+            merge_query = """
                 INSERT INTO stock_prices 
                 (symbol, timestamp, open, high, low, close, volume)
-                VALUES %s
+                SELECT symbol, timestamp, open, high, low, close, volume
+                FROM stock_prices_stage
                 ON CONFLICT (symbol, timestamp) 
                 DO UPDATE SET
                     open = EXCLUDED.open,
@@ -181,16 +367,16 @@ class StockDataFetcher:
                     updated_at = CURRENT_TIMESTAMP
             """
             
-            execute_values(cursor, insert_query, parsed_data)
+            cursor.execute(merge_query)
+            rows_affected = cursor.rowcount
             conn.commit()
             
-            rows_affected = cursor.rowcount
-            logger.info(f"Successfully inserted/updated {rows_affected} rows")
+            logger.info("Successfully inserted/updated %d rows", rows_affected)
             
             return rows_affected
             
         except psycopg2.Error as e:
-            logger.error(f"Database error: {e}")
+            logger.error("Database error: %s", e)
             if conn:
                 conn.rollback()
             raise
@@ -198,7 +384,7 @@ class StockDataFetcher:
             if cursor:
                 cursor.close()
             if conn:
-                conn.close()
+                self.release_db_connection(conn)
     
     def process_symbol(self, symbol: str) -> bool:
         """
@@ -211,16 +397,10 @@ class StockDataFetcher:
             bool: True if successful, False otherwise
         """
         try:
-            # Fetch data
-            stock_data = self.fetch_stock_data(symbol)
-            if not stock_data:
-                logger.warning(f"No data fetched for {symbol}")
-                return False
-            
-            # Parse data
-            parsed_data = self.parse_stock_data(stock_data)
+            # Fetch and parse data
+            parsed_data = self.fetch_and_parse(symbol)
             if not parsed_data:
-                logger.warning(f"No data parsed for {symbol}")
+                logger.warning("No data parsed for %s", symbol)
                 return False
             
             # Store data
@@ -229,12 +409,15 @@ class StockDataFetcher:
             return rows_affected > 0
             
         except Exception as e:
-            logger.error(f"Error processing {symbol}: {e}")
+            logger.error("Error processing %s: %s", symbol, e)
             return False
     
     def process_multiple_symbols(self, symbols: List[str]) -> Dict[str, bool]:
         """
-        Process multiple stock symbols with rate limiting.
+        Process multiple stock symbols concurrently with rate limiting.
+        
+        Data for all symbols is fetched first and then stored together in a
+        single transaction.
         
         Args:
             symbols (List[str]): List of stock symbols
@@ -242,49 +425,76 @@ class StockDataFetcher:
         Returns:
             Dict[str, bool]: Dictionary mapping symbols to success status
         """
-        results = {}
+        parsed = {}
         
-        for i, symbol in enumerate(symbols):
-            logger.info(f"Processing symbol {i+1}/{len(symbols)}: {symbol}")
-            results[symbol] = self.process_symbol(symbol)
-            
-            # Rate limiting: Alpha Vantage free tier allows 5 API calls per minute
-            if i < len(symbols) - 1:
-                logger.info("Waiting 12 seconds before next API call (rate limiting)")
-                time.sleep(12)
+        logger.info("Processing %d symbols with up to %d workers", len(symbols), MAX_WORKERS)
         
-        return results
+        # Symbols are independent, so fetch them concurrently and let the
+        # rate limiter keep API calls within quota
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(self.fetch_and_parse, symbol): symbol
+                for symbol in dict.fromkeys(symbols)
+            }
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    parsed[symbol] = future.result()
+                except Exception as e:
+                    logger.error("Error processing %s: %s", symbol, e)
+                    parsed[symbol] = []
+        
+        # Store all symbols at once
+        rows = [row for parsed_data in parsed.values() for row in parsed_data]
+        stored = False
+        if rows:
+            try:
+                stored = self.store_stock_data(rows) > 0
+            except Exception as e:
+                logger.error("Error storing data: %s", e)
+        
+        return {symbol: stored and bool(parsed[symbol]) for symbol in symbols}
 
 
 def main():
     """
     Main function to fetch and store stock data for configured symbols.
     """
+    # Configure logging when run as a script; Airflow configures its own
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     # Get stock symbols from environment variable
     symbols_str = os.getenv('STOCK_SYMBOLS', 'AAPL,GOOGL,MSFT')
     symbols = [s.strip() for s in symbols_str.split(',')]
     
-    logger.info(f"Starting stock data pipeline for symbols: {symbols}")
+    logger.info("Starting stock data pipeline for symbols: %s", symbols)
     
+    fetcher = None
     try:
         fetcher = StockDataFetcher()
         results = fetcher.process_multiple_symbols(symbols)
         
         # Log results
         success_count = sum(1 for v in results.values() if v)
-        logger.info(f"Pipeline completed: {success_count}/{len(symbols)} symbols processed successfully")
+        logger.info("Pipeline completed: %d/%d symbols processed successfully", success_count, len(symbols))
         
         for symbol, success in results.items():
             status = "SUCCESS" if success else "FAILED"
-            logger.info(f"{symbol}: {status}")
+            logger.info("%s: %s", symbol, status)
         
         # Exit with error code if any symbol failed
         if success_count < len(symbols):
             exit(1)
             
     except Exception as e:
-        logger.error(f"Fatal error in pipeline: {e}")
+        logger.error("Fatal error in pipeline: %s", e)
         exit(1)
+    finally:
+        if fetcher:
+            fetcher.close()
 
 
 if __name__ == "__main__":